@@ -0,0 +1,129 @@
+"""Benchmark JSON response building for the read-only chat endpoints.
+
+Compares, per response:
+  * ORM objects + ``to_dict()`` + Flask's stdlib JSON provider (previous path)
+  * SQL result rows + ``FastJSONProvider`` (orjson when installed)
+  * gzip / brotli compression of the encoded body
+
+Uses a throwaway in-memory SQLite database; run from ``chatbot-backend``::
+
+    python scripts/bench_serialization.py --sessions 200 --messages 200
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from src.models.user import db
+from src.models.chat import (
+    ChatSession, ChatMessage,
+    session_summary_select, session_row_to_dict, message_select, message_row_to_dict,
+)
+from src.services import serialization
+from src.services.serialization import FastJSONProvider
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def seed(n_sessions, n_messages):
+    start = datetime(2025, 1, 1)
+    for i in range(n_sessions):
+        sid = f"session-{i:05d}"
+        db.session.add(ChatSession(session_id=sid, title=f"Chat {i}",
+                                   created_at=start, updated_at=start + timedelta(minutes=i)))
+        for j in range(n_messages):
+            db.session.add(ChatMessage(
+                session_id=sid,
+                message_type='user' if j % 2 == 0 else 'bot',
+                content=("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 6)[:300],
+                has_pdf_context=bool(j % 3 == 0),
+                timestamp=start + timedelta(seconds=j),
+            ))
+    db.session.commit()
+
+
+def timeit(fn, repeat):
+    fn()  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def run(n_sessions, n_messages, repeat):
+    app = make_app()
+    stdlib = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    sid = 'session-00000'
+
+    with app.app_context():
+        db.create_all()
+        seed(n_sessions, n_messages)
+
+        def list_orm():
+            db.session.expire_all()
+            sessions = ChatSession.query.order_by(ChatSession.updated_at.desc()).all()
+            return stdlib.response([s.to_dict() for s in sessions]).get_data()
+
+        def list_rows():
+            rows = db.session.execute(session_summary_select().order_by(ChatSession.updated_at.desc())).all()
+            return fast.response([session_row_to_dict(r) for r in rows]).get_data()
+
+        def history_orm():
+            db.session.expire_all()
+            session = ChatSession.query.filter_by(session_id=sid).first()
+            messages = ChatMessage.query.filter_by(session_id=sid).order_by(ChatMessage.timestamp.asc()).all()
+            return stdlib.response({'session': session.to_dict(),
+                                    'messages': [m.to_dict() for m in messages]}).get_data()
+
+        def history_rows():
+            session_row = db.session.execute(session_summary_select().where(ChatSession.session_id == sid)).first()
+            rows = db.session.execute(message_select().where(ChatMessage.session_id == sid)
+                                      .order_by(ChatMessage.timestamp.asc())).all()
+            return fast.response({'session': session_row_to_dict(session_row),
+                                  'messages': [message_row_to_dict(r) for r in rows]}).get_data()
+
+        encoder = 'orjson' if serialization.orjson is not None else 'stdlib (orjson not installed)'
+        print(f"{n_sessions} sessions x {n_messages} messages, {repeat} runs each, fast encoder: {encoder}")
+        for name, before, after in (
+            ('GET /api/chat/sessions', list_orm, list_rows),
+            ('GET /api/chat/sessions/<id>', history_orm, history_rows),
+        ):
+            old_ms, body = timeit(before, repeat)
+            new_ms, _ = timeit(after, repeat)
+            print(f"{name:30} orm+to_dict+json {old_ms:8.2f} ms   rows+fast {new_ms:8.2f} ms   "
+                  f"speedup {old_ms / new_ms:5.2f}x   body {len(body) / 1024:8.1f} KiB")
+
+            gz_ms, gz = timeit(lambda: gzip.compress(body, compresslevel=serialization.COMPRESS_GZIP_LEVEL), repeat)
+            line = f"{'':30} gzip {gz_ms:6.2f} ms -> {len(gz) / 1024:7.1f} KiB"
+            if serialization.brotli is not None:
+                br_ms, br = timeit(lambda: serialization.brotli.compress(
+                    body, quality=serialization.COMPRESS_BROTLI_QUALITY), repeat)
+                line += f"   brotli {br_ms:6.2f} ms -> {len(br) / 1024:7.1f} KiB"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=200, help='messages per session')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+    run(args.sessions, args.messages, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+"""Replay a captured traffic log against a running instance.
+
+Capture traces with ``TRAFFIC_CAPTURE_PATH=traces.jsonl`` on the server, then
+start a local instance with the stub model, e.g.::
+
+    CHAT_MODEL_PROVIDER=stub gunicorn -w 4 -b 127.0.0.1:5000 src.main:app
+
+and replay::
+
+    python scripts/replay_traffic.py traces.jsonl --speedup 5
+
+Requests are sent at their recorded inter-arrival times divided by
+``--speedup``. Message bodies are synthesized with the recorded lengths.
+Uploaded files are built to within ``SIZE_TOLERANCE`` of the recorded size
+(xlsx/pptx are grown or shrunk until the saved file fits, but cannot be
+smaller than an empty workbook/deck, about 5 KB/30 KB). The report lists recorded
+vs. replayed upload bytes. The same file alias always gets the same
+synthetic bytes, so document reuse (and context caching) behaves like
+production. Sessions are re-created on the fly and reused in the recorded
+pattern.
+"""
+import argparse
+import io
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+UPLOAD_ROUTES = ('/api/upload-file', '/api/upload-pdf')
+SKIPPED_PREFIXES = ('/api/auth/', '/api/admin/')
+MAX_SYNTHETIC_BYTES = 64 * 1024 * 1024
+LOCK_MARKER = 'database is locked'
+# Acceptable relative difference between recorded and synthesized upload size
+SIZE_TOLERANCE = 0.05
+_MAX_FIT_ATTEMPTS = 8
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank method
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+# --- Synthetic payloads ---
+
+def _synthetic_csv(size: int) -> bytes:
+    header = b'id,name,value,category\n'
+    rows = [header]
+    total, i = len(header), 0
+    while total < size:
+        row = f"{i},item-{i},{i * 7 % 1000},cat-{i % 13}\n".encode()
+        rows.append(row)
+        total += len(row)
+        i += 1
+    return b''.join(rows)
+
+
+def _synthetic_pdf(size: int) -> bytes:
+    text = b'BT /F1 12 Tf 72 720 Td (Synthetic replay document) Tj ET\n'
+    # PDF comments pad the content stream up to the recorded size
+    padding = b'% ' + b'x' * max(size - 600, 0) + b'\n'
+    stream = text + padding
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+        b'/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>',
+        b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'endstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{num} 0 obj\n".encode() + body + b'\nendobj\n')
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def _fit_to_size(build, target: int) -> bytes:
+    """Call ``build(n)`` with item counts chosen by secant search until the result is near ``target``.
+
+    Zipped formats don't grow linearly with content, so the size is measured
+    rather than estimated. Returns the closest attempt.
+    """
+    lo_n, lo = 1, build(1)
+    best = lo
+    if len(lo) >= target:
+        return lo
+    # Probe with a guess proportional to the first result, then refine
+    n = max(2, int(target / len(lo)))
+    hi_n, hi = n, build(n)
+    for _ in range(_MAX_FIT_ATTEMPTS):
+        if abs(len(hi) - target) < abs(len(best) - target):
+            best = hi
+        if abs(len(best) - target) <= target * SIZE_TOLERANCE or hi_n == lo_n:
+            break
+        per_item = (len(hi) - len(lo)) / (hi_n - lo_n)
+        if per_item <= 0:
+            break
+        next_n = max(1, round(hi_n + (target - len(hi)) / per_item))
+        if next_n == hi_n:
+            break
+        lo_n, lo = hi_n, hi
+        hi_n, hi = next_n, build(next_n)
+    if abs(len(hi) - target) < abs(len(best) - target):
+        best = hi
+    return best
+
+
+def _random_text(rng: random.Random, length: int) -> str:
+    # Random hex compresses about as poorly as real cell/slide text
+    return '%0*x' % (length, rng.getrandbits(length * 4))
+
+
+def _build_xlsx(rows: int) -> bytes:
+    from openpyxl import Workbook
+
+    rng = random.Random(rows)
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['id', 'name', 'value', 'category'])
+    for i in range(rows):
+        ws.append([i, _random_text(rng, 12), rng.randint(0, 10 ** 6), f"cat-{i % 13}"])
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def _synthetic_xlsx(size: int) -> bytes:
+    return _fit_to_size(_build_xlsx, size)
+
+
+def _build_pptx(slides: int) -> bytes:
+    from pptx import Presentation
+
+    rng = random.Random(slides)
+    prs = Presentation()
+    for i in range(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = f"Slide {i}"
+        slide.placeholders[1].text = _random_text(rng, 4096)
+    out = io.BytesIO()
+    prs.save(out)
+    return out.getvalue()
+
+
+def _synthetic_pptx(size: int) -> bytes:
+    return _fit_to_size(_build_pptx, size)
+
+
+SYNTHESIZERS = {
+    'csv': (_synthetic_csv, 'replay.csv', 'text/csv'),
+    'pdf': (_synthetic_pdf, 'replay.pdf', 'application/pdf'),
+    'xlsx': (_synthetic_xlsx, 'replay.xlsx',
+             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'pptx': (_synthetic_pptx, 'replay.pptx',
+             'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+}
+
+
+class Replayer:
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.sessions = {}  # recorded session alias -> live session_id
+        self.first_use = {}  # recorded session alias -> Event set once its first request finished
+        self.files = {}     # recorded file alias -> synthetic bytes
+        self.upload_sizes = []  # (kind, recorded bytes, replayed bytes) per upload sent
+        self.results = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _http(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _file_for(self, info):
+        kind = info.get('k') or 'csv'
+        size = min(int(info.get('z') or 1024), MAX_SYNTHETIC_BYTES)
+        key = info.get('h') or f"{kind}-{size}"
+        with self._lock:
+            data = self.files.get(key)
+        if data is None:
+            synthesize, _, _ = SYNTHESIZERS.get(kind, SYNTHESIZERS['csv'])
+            data = synthesize(size)
+            with self._lock:
+                self.files[key] = data
+        _, filename, mimetype = SYNTHESIZERS.get(kind, SYNTHESIZERS['csv'])
+        with self._lock:
+            self.upload_sizes.append((kind, int(info.get('z') or 1024), len(data)))
+        return filename, data, mimetype
+
+    def _build(self, rec):
+        """Translate a trace record into requests kwargs, or None if it cannot be replayed."""
+        route, method = rec['r'], rec['m']
+        if route.startswith(SKIPPED_PREFIXES):
+            return None
+        alias = rec.get('sess')
+        with self._lock:
+            live_sid = self.sessions.get(alias) if alias else None
+        if '<session_id>' in route:
+            if not live_sid:
+                return None
+            route = route.replace('<session_id>', live_sid)
+        if re.search(r'<[^>]+>', route):
+            return None
+
+        kwargs = {}
+        if route in UPLOAD_ROUTES:
+            kwargs['files'] = {'file': self._file_for(rec.get('f') or {})}
+            if live_sid and not rec.get('new'):
+                kwargs['data'] = {'session_id': live_sid}
+        elif method in ('POST', 'PUT', 'PATCH'):
+            body = {}
+            if 'ml' in rec:
+                body['message'] = ('replay ' * (rec['ml'] // 7 + 1))[:max(rec['ml'], 1)]
+            if live_sid and not rec.get('new'):
+                body['session_id'] = live_sid
+            kwargs['json'] = body
+        return method, self.base_url + route, kwargs
+
+    def register(self, rec):
+        """Mark the first request of each session; later ones wait for it to learn the live id."""
+        alias = rec.get('sess')
+        if alias and alias not in self.first_use:
+            self.first_use[alias] = threading.Event()
+            return True
+        return False
+
+    def send(self, rec, owner=False):
+        alias = rec.get('sess')
+        try:
+            if alias and not owner:
+                self.first_use[alias].wait(self.timeout)
+            self._send(rec)
+        finally:
+            if owner:
+                self.first_use[alias].set()
+
+    def _send(self, rec):
+        built = self._build(rec)
+        if built is None:
+            with self._lock:
+                self.results.append({'route': rec['r'], 'skipped': True})
+            return
+        method, url, kwargs = built
+        started = time.perf_counter()
+        status, body, error = None, '', None
+        try:
+            resp = self._http().request(method, url, timeout=self.timeout, **kwargs)
+            status, body = resp.status_code, resp.text
+        except requests.RequestException as err:
+            error = type(err).__name__
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        new_sid = None
+        if status is not None and rec.get('sess'):
+            try:
+                new_sid = resp.json().get('session_id')
+            except (ValueError, AttributeError):
+                pass
+        with self._lock:
+            if new_sid and rec['sess'] not in self.sessions:
+                self.sessions[rec['sess']] = new_sid
+            self.results.append({
+                'route': f"{rec['m']} {rec['r']}",
+                'status': status,
+                'latency_ms': latency_ms,
+                'error': error or (status >= 400 if status else True),
+                'lock': LOCK_MARKER in body,
+            })
+
+
+def load_trace(path, limit=None):
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda r: r['t'])
+    return records[:limit] if limit else records
+
+
+def replay(records, base_url, speedup=1.0, concurrency=32, timeout=120.0):
+    replayer = Replayer(base_url, timeout)
+    if not records:
+        return replayer, 0.0
+    t0 = records[0]['t']
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for rec in records:
+            delay = (rec['t'] - t0) / speedup - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(replayer.send, rec, replayer.register(rec))
+    return replayer, time.perf_counter() - started
+
+
+def summarize(results, elapsed, server_records=None, upload_sizes=None):
+    sent = [r for r in results if not r.get('skipped')]
+    by_route = defaultdict(list)
+    for r in sent:
+        by_route[r['route']].append(r)
+
+    routes = {}
+    for route, rows in sorted(by_route.items()):
+        latencies = [r['latency_ms'] for r in rows if r['status'] is not None]
+        routes[route] = {
+            'count': len(rows),
+            'error_rate': round(sum(1 for r in rows if r['error']) / len(rows), 4),
+            'lock_errors': sum(1 for r in rows if r['lock']),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+        }
+    report = {
+        'elapsed_s': round(elapsed, 3),
+        'sent': len(sent),
+        'skipped': len(results) - len(sent),
+        'throughput_rps': round(len(sent) / elapsed, 2) if elapsed else None,
+        'error_rate': round(sum(1 for r in sent if r['error']) / len(sent), 4) if sent else None,
+        'lock_errors': sum(1 for r in sent if r['lock']),
+        'routes': routes,
+    }
+
+    if upload_sizes:
+        # Recorded vs. synthesized upload bytes, so size-driven latency differences are visible
+        by_kind = defaultdict(list)
+        for kind, recorded, replayed in upload_sizes:
+            by_kind[kind].append((recorded, replayed))
+        report['uploads'] = {
+            kind: {
+                'count': len(rows),
+                'recorded_bytes': sum(r for r, _ in rows),
+                'replayed_bytes': sum(p for _, p in rows),
+                'max_deviation_pct': round(max(abs(p - r) / r * 100 if r else 0.0 for r, p in rows), 1),
+            }
+            for kind, rows in sorted(by_kind.items())
+        }
+
+    if server_records:
+        # Server-side view from a capture taken during the replay
+        db_by_route = defaultdict(list)
+        locks = defaultdict(int)
+        for rec in server_records:
+            key = f"{rec['m']} {rec['r']}"
+            db_by_route[key].append(rec.get('db', 0))
+            locks[key] += 1 if rec.get('lock') else 0
+        report['server'] = {
+            key: {
+                'db_p50_ms': percentile(values, 50),
+                'db_p95_ms': percentile(values, 95),
+                'lock_events': locks[key],
+            }
+            for key, values in sorted(db_by_route.items())
+        }
+    return report
+
+
+def print_report(report):
+    print(f"sent={report['sent']} skipped={report['skipped']} elapsed={report['elapsed_s']}s "
+          f"throughput={report['throughput_rps']} req/s error_rate={report['error_rate']} "
+          f"lock_errors={report['lock_errors']}")
+    print(f"{'route':45} {'count':>6} {'err%':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'locks':>6}")
+
+    def ms(value):
+        return f"{value:.1f}" if value is not None else '-'
+
+    for route, stats in report['routes'].items():
+        print(f"{route:45} {stats['count']:>6} {stats['error_rate'] * 100:>6.1f} "
+              f"{ms(stats['p50_ms']):>9} {ms(stats['p95_ms']):>9} {ms(stats['p99_ms']):>9} "
+              f"{stats['lock_errors']:>6}")
+    for kind, stats in report.get('uploads', {}).items():
+        print(f"[upload] {kind:8} count={stats['count']} recorded={stats['recorded_bytes']}B "
+              f"replayed={stats['replayed_bytes']}B max_deviation={stats['max_deviation_pct']}%")
+    for route, stats in report.get('server', {}).items():
+        print(f"[server] {route:36} db_p50={ms(stats['db_p50_ms'])}ms "
+              f"db_p95={ms(stats['db_p95_ms'])}ms lock_events={stats['lock_events']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace', help='captured trace file (JSON lines)')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help='divide recorded inter-arrival times by this factor')
+    parser.add_argument('--concurrency', type=int, default=32, help='max in-flight requests')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--limit', type=int, help='replay only the first N requests')
+    parser.add_argument('--server-trace',
+                        help='trace captured by the target server during the replay, for DB time and lock stats')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    if args.speedup <= 0:
+        parser.error('--speedup must be positive')
+
+    records = load_trace(args.trace, args.limit)
+    replayer, elapsed = replay(records, args.base_url, args.speedup, args.concurrency, args.timeout)
+    server_records = load_trace(args.server_trace) if args.server_trace else None
+    report = summarize(replayer.results, elapsed, server_records, replayer.upload_sizes)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,12 +14,19 @@ from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.chat import chat_bp
 from src.routes.auth import auth_bp
+from src.routes.admin import admin_bp
+from src.services import profiling, serialization, traffic_capture
+from src.services.uploads import UploadRequest, MAX_CONTENT_LENGTH
 
 # --- App ---
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 
+# Stream multipart uploads into size-limited spools (see src/services/uploads.py)
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
 # --- SQLite path ---
 BASE_DIR = os.path.dirname(__file__)
 DB_DIR = os.path.join(BASE_DIR, 'database')
@@ -39,10 +46,25 @@ db.init_app(app)
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(chat_bp, url_prefix='/api')
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
+app.register_blueprint(admin_bp, url_prefix='/api/admin')
+
+# Opt-in request profiling (see src/services/profiling.py)
+profiling.init_app(app)
+
+# orjson-backed jsonify and gzip/brotli response compression
+serialization.init_app(app)
 
 # Create tables
 with app.app_context():
     db.create_all()
+    # create_all() skips existing tables, so add indexes declared since a table was created
+    # (e.g. chat_messages.session_id, used by set-based session deletes)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+# Anonymized trace capture for load replay, enabled by TRAFFIC_CAPTURE_PATH
+traffic_capture.init_app(app)
 
 # Health
 @app.get('/api/health')
@@ -16,8 +16,10 @@ class ChatSession(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow,
                            onupdate=datetime.utcnow, nullable=False)
     
-    # Relationship with messages
-    messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
+    # Relationship with messages. Deleting a session leaves the messages to the
+    # database (ON DELETE CASCADE) instead of loading them into the session first
+    messages = db.relationship('ChatMessage', backref='session', lazy=True,
+                               cascade='all, delete-orphan', passive_deletes=True)
     
     def to_dict(self):
         return {
@@ -34,7 +36,8 @@ class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
     
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(100), db.ForeignKey('chat_sessions.session_id'), nullable=False)
+    session_id = db.Column(db.String(100), db.ForeignKey('chat_sessions.session_id', ondelete='CASCADE'),
+                           nullable=False, index=True)
     message_type = db.Column(db.String(20), nullable=False)  # 'user', 'bot', 'system'
     content = db.Column(db.Text, nullable=False)
     has_pdf_context = db.Column(db.Boolean, default=False)
@@ -50,3 +53,72 @@ class ChatMessage(db.Model):
             'timestamp': self.timestamp.isoformat()
         }
 
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    # SHA-256 of the client-supplied Idempotency-Key (scoped to the caller),
+    # so the table stays compact regardless of how long clients make their keys
+    key_hash = db.Column(db.String(64), primary_key=True)
+    # Fingerprint of the request payload, so a key cannot be reused for a different message
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'completed'
+    status_code = db.Column(db.Integer)
+    # Lease held by the request processing a pending key; a retry may take over once it
+    # has passed (e.g. the owning worker was killed mid-request)
+    locked_until = db.Column(db.DateTime)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def response_json(self):
+        return json.loads(self.response_body) if self.response_body else None
+
+# Column-level queries for read-only endpoints: rows are turned into the same
+# shape as to_dict() without building ORM objects. Datetimes are left to the
+# JSON provider, which writes them as ISO 8601.
+
+def session_summary_select():
+    message_count = db.select(db.func.count(ChatMessage.id))\
+                      .where(ChatMessage.session_id == ChatSession.session_id)\
+                      .scalar_subquery()
+    return db.select(
+        ChatSession.id,
+        ChatSession.session_id,
+        ChatSession.user_id,
+        ChatSession.title,
+        ChatSession.created_at,
+        ChatSession.updated_at,
+        message_count.label('message_count'),
+    )
+
+def session_row_to_dict(row):
+    return {
+        'id': row.id,
+        'session_id': row.session_id,
+        'user_id': row.user_id,
+        'title': row.title,
+        'created_at': row.created_at,
+        'updated_at': row.updated_at,
+        'message_count': row.message_count,
+    }
+
+def message_select():
+    return db.select(
+        ChatMessage.id,
+        ChatMessage.session_id,
+        ChatMessage.message_type,
+        ChatMessage.content,
+        ChatMessage.has_pdf_context,
+        ChatMessage.timestamp,
+    )
+
+def message_row_to_dict(row):
+    return {
+        'id': row.id,
+        'session_id': row.session_id,
+        'type': row.message_type,
+        'content': row.content,
+        'has_pdf_context': row.has_pdf_context,
+        'timestamp': row.timestamp,
+    }
@@ -0,0 +1,51 @@
+import os
+
+from flask import Blueprint, jsonify, request, send_from_directory
+
+from src.services import profiling
+from src.services.admin import is_admin_request
+
+admin_bp = Blueprint('admin', __name__)
+
+
+@admin_bp.before_request
+def require_admin():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+
+@admin_bp.route('/profiling', methods=['GET'])
+def get_profiling_status():
+    return jsonify(profiling.get_status())
+
+
+@admin_bp.route('/profiling', methods=['POST'])
+def set_profiling():
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', profiling.PROFILE_MODE)
+    if mode not in profiling.MODES:
+        return jsonify({'error': f"mode must be one of: {', '.join(profiling.MODES)}"}), 400
+    try:
+        duration = float(data.get('duration_seconds', 300))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'duration_seconds must be a number'}), 400
+    profiling.set_toggle(
+        bool(data.get('enabled', True)),
+        duration_seconds=duration,
+        mode=mode,
+        path_prefix=data.get('path_prefix') or '/api/',
+    )
+    return jsonify(profiling.get_status())
+
+
+@admin_bp.route('/profiles', methods=['GET'])
+def list_profiles():
+    return jsonify(profiling.list_profiles())
+
+
+@admin_bp.route('/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    if (not name.endswith(profiling.PROFILE_EXTENSIONS)
+            or not os.path.isfile(os.path.join(profiling.PROFILE_DIR, name))):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(profiling.PROFILE_DIR, name, as_attachment=True)
@@ -3,25 +3,41 @@ from flask import Blueprint, jsonify, request
 import google.generativeai as genai
 import os
 import PyPDF2
-from io import BytesIO, StringIO
+from io import TextIOWrapper
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from pptx import Presentation
 import csv
 from openpyxl import load_workbook
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from src.models.user import db
 from src.models.auth import UserSession
-from src.models.chat import ChatSession, ChatMessage
+from src.models.chat import (
+    ChatSession, ChatMessage,
+    session_summary_select, session_row_to_dict, message_select, message_row_to_dict,
+)
+from src.services import idempotency, uploads
+from src.services.context_cache import DocumentContextCache
+from src.services.stub_model import StubModel
 
 load_dotenv()
 
 chat_bp = Blueprint('chat', __name__)
 
 # --- Gemini ---
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-model = genai.GenerativeModel('gemini-2.5-flash')
+MODEL_NAME = 'gemini-2.5-flash'
+# 'stub' swaps in an offline model for load tests (see src/services/stub_model.py)
+MODEL_PROVIDER = os.getenv('CHAT_MODEL_PROVIDER', 'gemini').lower()
+if MODEL_PROVIDER == 'stub':
+    model = StubModel()
+else:
+    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+    model = genai.GenerativeModel(MODEL_NAME)
+
+# Documents are sent as a stable, cached prefix (see src/services/context_cache.py)
+context_cache = DocumentContextCache.from_env(MODEL_NAME, default='local' if MODEL_PROVIDER == 'stub' else None)
 
 # Store document content in memory per-session (ephemeral, in-process only)
 # Keyed by session_id so a new chat does not inherit a previous chat's document
@@ -29,28 +45,51 @@ session_doc_content = {}
 
 MAX_CONTEXT_CHARS = 10000
 
+# Sessions deleted per transaction by the bulk delete endpoint
+BULK_DELETE_CHUNK = 500
+
 def _truncate(text: str, limit: int = MAX_CONTEXT_CHARS) -> str:
     if not text:
         return ""
     return text if len(text) <= limit else text[:limit] + "\n..."
 
-def _extract_pdf_text(file_storage) -> tuple[str, int]:
-    reader = PyPDF2.PdfReader(BytesIO(file_storage.read()))
+def _current_user_id():
+    session_token = request.headers.get('Authorization')
+    if not session_token:
+        return None
+    user_session = UserSession.query.filter_by(session_token=session_token, is_active=True).first()
+    return user_session.user_id if user_session else None
+
+def _delete_sessions(session_ids) -> int:
+    """Delete sessions and their messages with set-based SQL, without loading ORM objects."""
+    if not session_ids:
+        return 0
+    # Messages are deleted explicitly as well, since databases created before
+    # ON DELETE CASCADE was declared (or with SQLite foreign keys off) won't cascade
+    db.session.execute(
+        db.delete(ChatMessage).where(ChatMessage.session_id.in_(session_ids)),
+        execution_options={'synchronize_session': False},
+    )
+    result = db.session.execute(
+        db.delete(ChatSession).where(ChatSession.session_id.in_(session_ids)),
+        execution_options={'synchronize_session': False},
+    )
+    for sid in session_ids:
+        session_doc_content.pop(sid, None)
+    return result.rowcount
+
+# Extractors read the seekable upload spool directly (see src/services/uploads.py)
+def _extract_pdf_text(upload) -> tuple[str, int]:
+    reader = PyPDF2.PdfReader(upload)
     text_content = ""
     for page in reader.pages:
         page_text = page.extract_text() or ""
         text_content += page_text + "\n"
     return text_content, len(reader.pages)
 
-def _extract_csv_text(file_storage) -> tuple[str, dict]:
-    # Read bytes and decode to text for csv reader
-    data_bytes = file_storage.read()
-    try:
-        text = data_bytes.decode('utf-8', errors='replace')
-    except Exception:
-        text = data_bytes.decode('latin-1', errors='replace')
-
-    f = StringIO(text)
+def _extract_csv_text(upload) -> tuple[str, dict]:
+    # Decode incrementally instead of materialising the whole file as a string
+    f = TextIOWrapper(upload, encoding=upload.text_encoding(), errors='replace', newline='')
     reader = csv.reader(f)
     rows = []
     header = None
@@ -65,6 +104,7 @@ def _extract_csv_text(file_storage) -> tuple[str, dict]:
         row_count += 1
         if len("\n".join([",	".join(r) for r in rows])) > MAX_CONTEXT_CHARS:
             break
+    f.detach()  # leave the upload open for its owner
 
     columns = len(header) if header else 0
     summary_lines = [
@@ -80,9 +120,9 @@ def _extract_csv_text(file_storage) -> tuple[str, dict]:
             summary_lines.append(", ".join(r))
     return "\n".join(summary_lines), {"rows": max(row_count - 1, 0), "columns": columns}
 
-def _extract_excel_text(file_storage) -> tuple[str, dict]:
+def _extract_excel_text(upload) -> tuple[str, dict]:
     # Load workbook in read-only mode
-    wb = load_workbook(filename=BytesIO(file_storage.read()), read_only=True, data_only=True)
+    wb = load_workbook(filename=upload, read_only=True, data_only=True)
     sheet = wb.active
     sheet_name = sheet.title
     max_rows = sheet.max_row or 0
@@ -114,8 +154,8 @@ def _extract_excel_text(file_storage) -> tuple[str, dict]:
     text = "\n".join(summary_lines)
     return text, {"sheet": sheet_name, "rows": max(max_rows - 1, 0), "columns": max_cols}
 
-def _extract_ppt_text(file_storage) -> tuple[str, int]:
-    prs = Presentation(BytesIO(file_storage.read()))
+def _extract_ppt_text(upload) -> tuple[str, int]:
+    prs = Presentation(upload)
     lines = []
     for i, slide in enumerate(prs.slides, start=1):
         lines.append(f"Slide {i}:")
@@ -130,7 +170,12 @@ def _extract_ppt_text(file_storage) -> tuple[str, int]:
 
 @chat_bp.route('/chat', methods=['POST'])
 def chat():
-    """Chat endpoint: ensures a non-null session_id and persists both messages."""
+    """Chat endpoint: ensures a non-null session_id and persists both messages.
+
+    Clients may send an ``Idempotency-Key`` header; retries with the same key
+    get the stored response instead of a second model call.
+    """
+    key_hash = None
     try:
         data = request.get_json(silent=True) or {}
         user_message = (data.get('message') or '').strip()
@@ -139,6 +184,25 @@ def chat():
         if not user_message:
             return jsonify({'error': 'Message is required'}), 400
 
+        idempotency_key = (request.headers.get('Idempotency-Key') or '').strip()
+        if idempotency_key:
+            if len(idempotency_key) > idempotency.MAX_KEY_LENGTH:
+                return jsonify({'error': 'Idempotency-Key is too long'}), 400
+            # Scope keys to something the caller owns so clients can't read each other's
+            # stored responses: the auth token, or for anonymous callers their session
+            session_token = request.headers.get('Authorization')
+            if session_token:
+                scope = f"auth:{session_token}"
+            elif client_session_id:
+                scope = f"session:{client_session_id}"
+            else:
+                return jsonify({'error': 'Anonymous requests with an Idempotency-Key must include session_id'}), 400
+            claim_hash = idempotency.hash_key(idempotency_key, scope)
+            replay = idempotency.begin(claim_hash, idempotency.hash_request(user_message, client_session_id))
+            if replay is not None:
+                return replay
+            key_hash = claim_hash
+
         # Always guarantee a session_id
         session_id = client_session_id or str(uuid.uuid4())
 
@@ -170,22 +234,18 @@ def chat():
         )
         db.session.add(user_msg)
 
-        # Compose prompt/context
-        if doc_content_for_session:
-            prompt = (
-                "Use the following document content to answer.\n\nDOCUMENT:\n"
-                f"{doc_content_for_session}\n\nUser question:\n{user_message}"
-            )
-        else:
-            prompt = user_message
-
-        # Call Gemini robustly
+        # Call Gemini robustly; document turns reuse the cached document prefix
+        model_failed = False
         try:
-            resp = model.generate_content(prompt)
+            if doc_content_for_session:
+                resp = context_cache.generate(model, doc_content_for_session, user_message)
+            else:
+                resp = model.generate_content(user_message)
             bot_text = getattr(resp, 'text', None) or "Sorry, I couldn't generate a response."
             
         except Exception as llm_err:
             bot_text = f"Model error: {llm_err}"
+            model_failed = True
 
         # Save the bot message
         bot_msg = ChatMessage(
@@ -199,19 +259,37 @@ def chat():
         # Update session timestamp
         chat_session.updated_at = datetime.utcnow()
 
-        db.session.commit()
-
-        return jsonify({
+        payload = {
             'response': bot_text,
             'has_pdf_context': bool(doc_content_for_session),
             'session_id': session_id
-        })
+        }
+        if key_hash and not model_failed:
+            # Stored in the same transaction as the messages
+            idempotency.complete(key_hash, payload)
+
+        db.session.commit()
+        if key_hash:
+            if model_failed:
+                # Don't replay a transient model failure; let a retry call the model again
+                idempotency.abandon(key_hash)
+            else:
+                idempotency.release(key_hash)
+
+        return jsonify(payload)
 
     except Exception as e:
         db.session.rollback()
+        if key_hash:
+            idempotency.abandon(key_hash)
         return jsonify({'error': str(e)}), 500
 
 
+@chat_bp.route('/chat/context-cache/stats', methods=['GET'])
+def get_context_cache_stats():
+    return jsonify(context_cache.stats())
+
+
 @chat_bp.route('/chat/sessions', methods=['GET'])
 def get_chat_sessions():
     try:
@@ -223,15 +301,16 @@ def get_chat_sessions():
             if user_session:
                 user_id = user_session.user_id
 
-        query = ChatSession.query
+        query = session_summary_select()
         if user_id:
-            query = query.filter_by(user_id=user_id)
+            query = query.where(ChatSession.user_id == user_id)
         else:
             # For anonymous users, only return sessions with null user_id
-            query = query.filter(ChatSession.user_id.is_(None))
+            query = query.where(ChatSession.user_id.is_(None))
 
-        sessions = query.order_by(ChatSession.updated_at.desc()).all()
-        return jsonify([s.to_dict() for s in sessions])
+        # Read-only: serialize straight from result rows instead of ORM objects
+        rows = db.session.execute(query.order_by(ChatSession.updated_at.desc())).all()
+        return jsonify([session_row_to_dict(row) for row in rows])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -239,16 +318,20 @@ def get_chat_sessions():
 @chat_bp.route('/chat/sessions/<session_id>', methods=['GET'])
 def get_chat_session(session_id):
     try:
-        session = ChatSession.query.filter_by(session_id=session_id).first()
-        if not session:
+        session_row = db.session.execute(
+            session_summary_select().where(ChatSession.session_id == session_id)
+        ).first()
+        if not session_row:
             return jsonify({'error': 'Session not found'}), 404
 
-        messages = ChatMessage.query.filter_by(session_id=session_id)\
-                                    .order_by(ChatMessage.timestamp.asc()).all()
+        message_rows = db.session.execute(
+            message_select().where(ChatMessage.session_id == session_id)
+                            .order_by(ChatMessage.timestamp.asc())
+        ).all()
 
         return jsonify({
-            'session': session.to_dict(),
-            'messages': [m.to_dict() for m in messages]
+            'session': session_row_to_dict(session_row),
+            'messages': [message_row_to_dict(row) for row in message_rows]
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -257,22 +340,19 @@ def get_chat_session(session_id):
 @chat_bp.route('/chat/sessions/<session_id>', methods=['DELETE'])
 def delete_chat_session(session_id):
     try:
-        session_token = request.headers.get('Authorization')
-        user_id = None
-        if session_token:
-            user_session = UserSession.query.filter_by(session_token=session_token, is_active=True).first()
-            if user_session:
-                user_id = user_session.user_id
+        user_id = _current_user_id()
 
-        session = ChatSession.query.filter_by(session_id=session_id).first()
-        if not session:
+        row = db.session.execute(
+            db.select(ChatSession.user_id).where(ChatSession.session_id == session_id)
+        ).first()
+        if not row:
             return jsonify({'error': 'Session not found'}), 404
 
         # Only allow deletion if the session belongs to the current user or is anonymous
-        if session.user_id and session.user_id != user_id:
+        if row.user_id and row.user_id != user_id:
             return jsonify({'error': 'Forbidden'}), 403
 
-        db.session.delete(session)
+        _delete_sessions([session_id])
         db.session.commit()
         return jsonify({'message': 'Session deleted successfully'})
     except Exception as e:
@@ -280,6 +360,80 @@ def delete_chat_session(session_id):
         return jsonify({'error': str(e)}), 500
 
 
+@chat_bp.route('/chat/sessions/bulk-delete', methods=['POST'])
+def bulk_delete_chat_sessions():
+    """Delete many sessions in chunked transactions.
+
+    Body: ``{"session_ids": [...]}`` to delete specific sessions, or
+    ``{"older_than": "<ISO datetime>"}`` / ``{"older_than_days": N}`` to delete
+    all of the caller's sessions last updated before the cutoff (authenticated
+    callers only, since anonymous sessions have no owner to scope by).
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = _current_user_id()
+        # Same rule as single deletion: the caller's own sessions or anonymous ones
+        if user_id:
+            allowed = db.or_(ChatSession.user_id == user_id, ChatSession.user_id.is_(None))
+        else:
+            allowed = ChatSession.user_id.is_(None)
+
+        deleted = 0
+        session_ids = data.get('session_ids')
+        if session_ids is not None:
+            if not isinstance(session_ids, list):
+                return jsonify({'error': 'session_ids must be a list'}), 400
+            session_ids = list(dict.fromkeys(str(sid) for sid in session_ids))
+            for i in range(0, len(session_ids), BULK_DELETE_CHUNK):
+                chunk = session_ids[i:i + BULK_DELETE_CHUNK]
+                owned = db.session.execute(
+                    db.select(ChatSession.session_id).where(ChatSession.session_id.in_(chunk), allowed)
+                ).scalars().all()
+                deleted += _delete_sessions(owned)
+                db.session.commit()
+            return jsonify({'deleted': deleted, 'skipped': len(session_ids) - deleted})
+
+        if data.get('older_than') is None and data.get('older_than_days') is None:
+            return jsonify({'error': 'Provide session_ids, older_than or older_than_days'}), 400
+        if not user_id:
+            return jsonify({'error': 'Authentication required for cutoff deletes'}), 401
+
+        if data.get('older_than') is not None:
+            try:
+                cutoff = datetime.fromisoformat(str(data['older_than']))
+            except ValueError:
+                return jsonify({'error': 'older_than must be an ISO 8601 datetime'}), 400
+            if cutoff.tzinfo is not None:
+                # Timestamps are stored as naive UTC
+                cutoff = cutoff.astimezone(timezone.utc).replace(tzinfo=None)
+        else:
+            try:
+                days = float(data['older_than_days'])
+                if days < 0:
+                    raise ValueError
+                cutoff = datetime.utcnow() - timedelta(days=days)
+            except (TypeError, ValueError, OverflowError):
+                return jsonify({'error': 'older_than_days must be a non-negative number'}), 400
+        if cutoff > datetime.utcnow():
+            return jsonify({'error': 'Cutoff must not be in the future'}), 400
+
+        scope = ChatSession.user_id == user_id
+        while True:
+            chunk = db.session.execute(
+                db.select(ChatSession.session_id)
+                  .where(scope, ChatSession.updated_at < cutoff)
+                  .limit(BULK_DELETE_CHUNK)
+            ).scalars().all()
+            if not chunk:
+                break
+            deleted += _delete_sessions(chunk)
+            db.session.commit()
+        return jsonify({'deleted': deleted})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @chat_bp.route('/chat/new-session', methods=['POST'])
 def create_new_session():
     try:
@@ -323,23 +477,33 @@ def upload_file():
         file = request.files['file']
         if not file.filename:
             return jsonify({'error': 'No file selected'}), 400
-        name_lower = file.filename.lower()
-        result = { 'session_id': session_id }
 
-        if name_lower.endswith('.pdf'):
-            text_content, pages = _extract_pdf_text(file)
+        kind = uploads.kind_from_filename(file.filename)
+        if kind is None:
+            return jsonify({'error': 'Unsupported file type. Allowed: .pdf, .csv, .xlsx, .pptx'}), 400
+
+        # The body was already spooled, size-checked and hashed while it was received
+        upload = uploads.ensure_spool(file)
+        detected = upload.sniff_kind()
+        if detected == 'ppt':
+            return jsonify({'error': 'Legacy .ppt files are not supported. Please save as .pptx'}), 400
+        if detected != kind:
+            return jsonify({'error': f'File content does not match its .{kind} extension'}), 400
+
+        result = { 'session_id': session_id, 'sha256': upload.sha256, 'size': upload.size }
+
+        if kind == 'pdf':
+            text_content, pages = _extract_pdf_text(upload)
             result.update({'message': 'File uploaded successfully', 'kind': 'pdf', 'pages': pages})
-        elif name_lower.endswith('.csv'):
-            text_content, meta = _extract_csv_text(file)
+        elif kind == 'csv':
+            text_content, meta = _extract_csv_text(upload)
             result.update({'message': 'File uploaded successfully', 'kind': 'csv', **meta})
-        elif name_lower.endswith('.xlsx'):
-            text_content, meta = _extract_excel_text(file)
+        elif kind == 'xlsx':
+            text_content, meta = _extract_excel_text(upload)
             result.update({'message': 'File uploaded successfully', 'kind': 'xlsx', **meta})
-        elif name_lower.endswith('.ppt') or name_lower.endswith('.pptx'):
-            text_content, slides = _extract_ppt_text(file)
-            result.update({'message': 'File uploaded successfully', 'kind': 'pptx', 'slides': slides})
         else:
-            return jsonify({'error': 'Unsupported file type. Allowed: .pdf, .csv, .xlsx, .ppt, .pptx'}), 400
+            text_content, slides = _extract_ppt_text(upload)
+            result.update({'message': 'File uploaded successfully', 'kind': 'pptx', 'slides': slides})
 
         # Store document text for this session only (truncated)
         text_content = _truncate(text_content)
@@ -348,6 +512,8 @@ def upload_file():
         preview = (text_content[:200] + "...") if len(text_content) > 200 else text_content
         result['preview'] = preview
         return jsonify(result)
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
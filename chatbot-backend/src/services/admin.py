@@ -0,0 +1,17 @@
+# src/services/admin.py
+import hmac
+import os
+
+from flask import request
+
+
+def is_admin_request() -> bool:
+    """True when the request carries the ADMIN_TOKEN in ``X-Admin-Token``.
+
+    Admin features are disabled entirely while ADMIN_TOKEN is unset.
+    """
+    admin_token = os.getenv('ADMIN_TOKEN')
+    supplied = request.headers.get('X-Admin-Token')
+    if not admin_token or not supplied:
+        return False
+    return hmac.compare_digest(supplied.encode('utf-8'), admin_token.encode('utf-8'))
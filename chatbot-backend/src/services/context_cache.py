@@ -0,0 +1,310 @@
+# src/services/context_cache.py
+"""Document-prefix context caching.
+
+Document questions are sent with a stable layout: the instruction and the
+document text form a prefix that is identical on every turn, and only the
+question changes. The prefix is registered once per document fingerprint
+through the provider's cached-content mechanism, and later turns reference
+the cached handle instead of resending the document.
+
+Caches are tracked per process (like ``session_doc_content``). A cache that
+is used close to its expiry gets its TTL extended; unused ones simply expire.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+DOCUMENT_INSTRUCTION = "Use the following document content to answer."
+
+CONTEXT_CACHE_TTL = int(os.getenv('CONTEXT_CACHE_TTL_SECONDS', 3600))
+# Extend a cache's lifetime when it is used with less than this many seconds left
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv('CONTEXT_CACHE_REFRESH_MARGIN_SECONDS', 600))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv('CONTEXT_CACHE_MAX_ENTRIES', 256))
+# Prefixes estimated below this are never sent for caching (the provider rejects them)
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv('CONTEXT_CACHE_MIN_TOKENS', 1024))
+
+logger = logging.getLogger(__name__)
+
+
+def document_prefix(doc_text: str) -> str:
+    return f"{DOCUMENT_INSTRUCTION}\n\nDOCUMENT:\n{doc_text}"
+
+
+def question_suffix(user_message: str) -> str:
+    return f"User question:\n{user_message}"
+
+
+def fingerprint(doc_text: str) -> str:
+    return hashlib.sha256(doc_text.encode('utf-8')).hexdigest()
+
+
+def _estimate_tokens(text: str) -> int:
+    # Rough rule of thumb for English text; only used when the provider reports nothing
+    return max(len(text) // 4, 1)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class CacheEntry:
+    fingerprint: str
+    handle: str | None          # None marks a prefix the provider refused to cache
+    model: object | None        # model bound to the cached prefix
+    expires_at: datetime
+    prefix_tokens: int
+    hits: int = 0
+
+
+class GeminiCacheBackend:
+    """Registers prefixes with Gemini's CachedContent API."""
+    simulated = False
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def create(self, base_model, prefix: str, ttl: int):
+        from google.generativeai import caching, GenerativeModel
+
+        cached = caching.CachedContent.create(
+            model=self.model_name,
+            display_name=f"doc-{fingerprint(prefix)[:16]}",
+            contents=[prefix],
+            ttl=timedelta(seconds=ttl),
+        )
+        usage = getattr(cached, 'usage_metadata', None)
+        tokens = getattr(usage, 'total_token_count', 0) or _estimate_tokens(prefix)
+        return cached.name, GenerativeModel.from_cached_content(cached), cached.expire_time, tokens
+
+    def refresh(self, handle: str, ttl: int) -> datetime:
+        from google.generativeai import caching
+
+        cached = caching.CachedContent.get(handle)
+        cached.update(ttl=timedelta(seconds=ttl))
+        return cached.expire_time
+
+    def delete(self, handle: str):
+        from google.generativeai import caching
+
+        caching.CachedContent.get(handle).delete()
+
+    def is_stale_error(self, err: Exception) -> bool:
+        from google.api_core import exceptions
+
+        return isinstance(err, (exceptions.NotFound, exceptions.PermissionDenied))
+
+
+class _PrefixedModel:
+    def __init__(self, base_model, prefix: str):
+        self._base_model = base_model
+        self._prefix = prefix
+
+    def generate_content(self, contents):
+        if not isinstance(contents, list):
+            contents = [contents]
+        return self._base_model.generate_content([self._prefix, *contents])
+
+
+class LocalCacheBackend:
+    """In-process stand-in for tests and offline runs: handles are local and the prefix is re-sent."""
+    simulated = True  # nothing is actually saved; token savings are reported separately
+
+    def __init__(self):
+        self._counter = 0
+
+    def create(self, base_model, prefix: str, ttl: int):
+        self._counter += 1
+        handle = f"local/{fingerprint(prefix)[:16]}-{self._counter}"
+        expires_at = _utcnow() + timedelta(seconds=ttl)
+        return handle, _PrefixedModel(base_model, prefix), expires_at, _estimate_tokens(prefix)
+
+    def refresh(self, handle: str, ttl: int) -> datetime:
+        return _utcnow() + timedelta(seconds=ttl)
+
+    def delete(self, handle: str):
+        pass
+
+    def is_stale_error(self, err: Exception) -> bool:
+        return False
+
+
+class DocumentContextCache:
+    """Per-process map of document fingerprint -> cached prefix.
+
+    ``_lock`` only guards ``_entries``, ``_pending`` and the metrics; provider
+    calls (create/refresh/delete) run outside it. Concurrent requests for a
+    document that is being registered wait on that fingerprint's Event only.
+    """
+
+    def __init__(self, backend=None, ttl: int = CONTEXT_CACHE_TTL,
+                 refresh_margin: int = CONTEXT_CACHE_REFRESH_MARGIN,
+                 max_entries: int = CONTEXT_CACHE_MAX_ENTRIES,
+                 min_tokens: int = CONTEXT_CACHE_MIN_TOKENS):
+        self.backend = backend  # None disables caching; prompts keep the stable layout
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        self._entries = OrderedDict()
+        self._pending = {}    # fingerprint -> Event set once its cache is registered
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._metrics = {
+            'cache_hits': 0,
+            'caches_created': 0,
+            'caches_refreshed': 0,
+            'create_failures': 0,
+            'skipped_too_small': 0,
+            'uncached_requests': 0,
+            'saved_input_tokens': 0,
+            'simulated_saved_input_tokens': 0,
+        }
+
+    @classmethod
+    def from_env(cls, model_name: str, default: str | None = None):
+        default = default or ('gemini' if os.getenv('GEMINI_API_KEY') else 'local')
+        kind = os.getenv('CONTEXT_CACHE_BACKEND', default).lower()
+        if kind == 'gemini':
+            return cls(GeminiCacheBackend(model_name))
+        if kind == 'local':
+            return cls(LocalCacheBackend())
+        return cls(None)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def _pop(self, entry: CacheEntry):
+        """Drop ``entry`` from the map (caller holds the lock); returns its handle for deletion."""
+        if self._entries.get(entry.fingerprint) is entry:
+            del self._entries[entry.fingerprint]
+        return entry.handle
+
+    def _delete_handles(self, handles):
+        for handle in handles:
+            if handle:
+                try:
+                    self.backend.delete(handle)
+                except Exception:
+                    pass  # the provider expires it on its own
+
+    def _lookup(self, fp: str, now: datetime, stale: list):
+        """Return (entry, pending_event, owner) for ``fp``; caller holds the lock."""
+        entry = self._entries.get(fp)
+        if entry is not None and entry.expires_at <= now:
+            stale.append(self._pop(entry))
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(fp)
+            return entry, None, False
+        event = self._pending.get(fp)
+        if event is not None:
+            return None, event, False
+        self._pending[fp] = threading.Event()
+        return None, None, True
+
+    def _refresh(self, entry: CacheEntry):
+        try:
+            expires_at = self.backend.refresh(entry.handle, self.ttl)
+        except Exception:
+            expires_at = None  # keep using it until it actually expires
+        with self._lock:
+            self._refreshing.discard(entry.fingerprint)
+            if expires_at is not None:
+                entry.expires_at = expires_at
+                self._metrics['caches_refreshed'] += 1
+
+    def _create(self, base_model, doc_text: str, fp: str) -> CacheEntry:
+        prefix = document_prefix(doc_text)
+        # Negative entries (handle None) stop us from retrying every turn until the TTL passes
+        handle, model, expires_at, tokens = None, None, _utcnow() + timedelta(seconds=self.ttl), 0
+        if _estimate_tokens(prefix) < self.min_tokens:
+            outcome = 'skipped_too_small'
+        else:
+            try:
+                handle, model, expires_at, tokens = self.backend.create(base_model, prefix, self.ttl)
+                outcome = 'caches_created'
+            except Exception:
+                logger.warning('context cache create failed for %s; sending full prompts', fp[:16], exc_info=True)
+                outcome = 'create_failures'
+        entry = CacheEntry(fp, handle, model, expires_at, tokens)
+        evicted = []
+        with self._lock:
+            self._metrics[outcome] += 1
+            self._entries[fp] = entry
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._pop(next(iter(self._entries.values()))))
+        self._delete_handles(evicted)
+        return entry
+
+    def _get_entry(self, base_model, doc_text: str):
+        fp = fingerprint(doc_text)
+        while True:
+            stale = []
+            with self._lock:
+                entry, event, owner = self._lookup(fp, _utcnow(), stale)
+                needs_refresh = (
+                    entry is not None and entry.handle
+                    and fp not in self._refreshing
+                    and (entry.expires_at - _utcnow()).total_seconds() < self.refresh_margin
+                )
+                if needs_refresh:
+                    self._refreshing.add(fp)
+            self._delete_handles(stale)
+
+            if entry is not None:
+                if needs_refresh:
+                    self._refresh(entry)
+                return entry
+            if owner:
+                try:
+                    return self._create(base_model, doc_text, fp)
+                finally:
+                    with self._lock:
+                        done = self._pending.pop(fp, None)
+                    if done is not None:
+                        done.set()
+            # Another request is registering this document; wait for it, then look again
+            event.wait()
+
+    def generate(self, base_model, doc_text: str, user_message: str):
+        """Answer ``user_message`` about ``doc_text``, using a cached document prefix when possible."""
+        if self.backend is not None:
+            entry = self._get_entry(base_model, doc_text)
+            if entry.handle:
+                try:
+                    resp = entry.model.generate_content(question_suffix(user_message))
+                except Exception as err:
+                    if not self.backend.is_stale_error(err):
+                        raise
+                    with self._lock:
+                        handle = self._pop(entry)
+                    self._delete_handles([handle])
+                else:
+                    # Only tokens the provider reports as served from cache count as saved
+                    usage = getattr(resp, 'usage_metadata', None)
+                    saved = getattr(usage, 'cached_content_token_count', 0) or 0
+                    with self._lock:
+                        entry.hits += 1
+                        self._metrics['cache_hits'] += 1
+                        self._metrics['saved_input_tokens'] += saved
+                        if self.backend.simulated:
+                            self._metrics['simulated_saved_input_tokens'] += entry.prefix_tokens
+                    return resp
+
+        self._count('uncached_requests')
+        return base_model.generate_content([document_prefix(doc_text), question_suffix(user_message)])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__ if self.backend is not None else None,
+                'simulated': bool(self.backend is not None and self.backend.simulated),
+                'entries': sum(1 for e in self._entries.values() if e.handle),
+                **self._metrics,
+            }
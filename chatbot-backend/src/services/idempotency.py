@@ -0,0 +1,197 @@
+# src/services/idempotency.py
+"""Idempotency-Key support for POST endpoints.
+
+A client that retries a request with the same ``Idempotency-Key`` header gets
+the stored response of the first attempt instead of triggering a second model
+call. A retry that arrives while the first attempt is still running waits for
+it (in-process via an Event, across workers by polling the table), but only
+for a short while so a sync worker is not held past its timeout. A pending
+key whose lease expired (its worker died) is taken over by the next retry.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import jsonify
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db
+from src.models.chat import IdempotencyKey
+
+IDEMPOTENCY_TTL = timedelta(seconds=int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 24 * 3600)))
+# How long a retry waits for an in-flight original before giving up with 409.
+# Keep this well below the worker timeout (gunicorn defaults to 30s).
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 10))
+# How long a pending key stays locked to the request processing it
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', 60))
+MAX_KEY_LENGTH = 255
+
+_POLL_INTERVAL = 0.25
+_PURGE_INTERVAL = 300
+
+# key_hash -> Event set once the owning request in this process finishes
+_inflight = {}
+_inflight_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def hash_key(raw_key: str, scope: str = '') -> str:
+    """Hash the client key together with the caller scope (auth token or owned session)."""
+    return hashlib.sha256(f"{scope}\0{raw_key}".encode('utf-8')).hexdigest()
+
+
+def hash_request(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def _purge_expired():
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < _PURGE_INTERVAL:
+        return
+    _last_purge = now
+    db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow()))
+    db.session.commit()
+
+
+def _try_claim(key_hash: str, request_hash: str) -> bool:
+    now = datetime.utcnow()
+    try:
+        # Core insert: a copy of the row may already be in the identity map from polling
+        db.session.execute(db.insert(IdempotencyKey).values(
+            key_hash=key_hash,
+            request_hash=request_hash,
+            status='pending',
+            locked_until=now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+            created_at=now,
+            expires_at=now + IDEMPOTENCY_TTL,
+        ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if not _take_over_stale(key_hash, request_hash):
+            return False
+    with _inflight_lock:
+        _inflight[key_hash] = threading.Event()
+    return True
+
+
+def _take_over_stale(key_hash: str, request_hash: str) -> bool:
+    """Claim a pending key whose lease expired; atomic, so only one retry wins."""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        db.update(IdempotencyKey)
+          .where(
+              IdempotencyKey.key_hash == key_hash,
+              IdempotencyKey.request_hash == request_hash,
+              IdempotencyKey.status == 'pending',
+              db.or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until < now),
+          )
+          .values(locked_until=now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _load(key_hash: str):
+    # End any open read transaction so rows committed by other workers are visible
+    db.session.rollback()
+    record = db.session.get(IdempotencyKey, key_hash, populate_existing=True)
+    if record is not None and record.expires_at < datetime.utcnow():
+        db.session.delete(record)
+        db.session.commit()
+        return None
+    return record
+
+
+def _wait_for_result(key_hash: str, request_hash: str, deadline: float):
+    while True:
+        record = _load(key_hash)
+        if record is None or record.status == 'completed':
+            return record
+        if record.request_hash != request_hash:
+            return record  # key reused for a different request; no point waiting
+        if record.locked_until and record.locked_until < datetime.utcnow():
+            return record  # stale lease; the caller can take it over
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return record
+        with _inflight_lock:
+            event = _inflight.get(key_hash)
+        if event is not None:
+            event.wait(min(remaining, _POLL_INTERVAL))
+        else:
+            time.sleep(min(remaining, _POLL_INTERVAL))
+
+
+def begin(key_hash: str, request_hash: str):
+    """Claim ``key_hash`` for the current request.
+
+    Returns None when the caller owns the key and should process the request,
+    otherwise a ready Flask response (stored replay, mismatch or conflict).
+    """
+    _purge_expired()
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        if _try_claim(key_hash, request_hash):
+            return None
+        record = _wait_for_result(key_hash, request_hash, deadline)
+        if record is None:
+            # The original attempt failed and released the key; take it over
+            if time.monotonic() < deadline:
+                continue
+            break
+        if record.request_hash != request_hash:
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if record.status == 'pending' and record.locked_until and record.locked_until < datetime.utcnow():
+            # The owner's lease expired while we waited; try to take it over
+            if time.monotonic() < deadline:
+                continue
+            break
+        if record.status == 'completed':
+            resp = jsonify(record.response_json())
+            resp.status_code = record.status_code or 200
+            resp.headers['Idempotent-Replayed'] = 'true'
+            return resp
+        break
+
+    resp = jsonify({'error': 'A request with this Idempotency-Key is still in progress'})
+    resp.status_code = 409
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+
+def complete(key_hash: str, body, status_code: int = 200):
+    """Attach the response to the claimed key; committed with the caller's transaction."""
+    record = db.session.get(IdempotencyKey, key_hash)
+    if record is None:
+        return
+    record.status = 'completed'
+    record.status_code = status_code
+    record.response_body = json.dumps(body)
+
+
+def abandon(key_hash: str):
+    """Drop a pending key after a failed attempt so a retry can run it again."""
+    try:
+        db.session.execute(db.delete(IdempotencyKey).where(
+            IdempotencyKey.key_hash == key_hash,
+            IdempotencyKey.status == 'pending',
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+    finally:
+        release(key_hash)
+
+
+def release(key_hash: str):
+    """Wake up in-process retries waiting on ``key_hash``."""
+    with _inflight_lock:
+        event = _inflight.pop(key_hash, None)
+    if event is not None:
+        event.set()
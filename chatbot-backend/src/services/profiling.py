@@ -0,0 +1,271 @@
+# src/services/profiling.py
+"""On-demand request profiling.
+
+A request is profiled when any of these holds:
+  * it sends ``X-Profile: 1`` (or ``cprofile`` / ``sample``) with a valid admin token,
+  * profiling was switched on through ``POST /api/admin/profiling``,
+  * it is picked by background sampling (``PROFILE_SAMPLE_RATE``).
+
+Two collectors are available: ``cprofile`` (deterministic, written as
+``.pstats``) and ``sample`` (a low-overhead stack sampler, written as
+speedscope JSON). Profiles go to a bounded on-disk ring buffer, so the
+oldest files are removed once ``PROFILE_MAX_FILES`` is reached.
+The admin toggle is stored in ``PROFILE_DIR/toggle.json`` so every worker
+process sees it; workers re-read it at most every ``_TOGGLE_CACHE_SECONDS``.
+"""
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request
+
+from src.services.admin import is_admin_request
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 50))
+# Fraction of requests (0.0 - 1.0) profiled in the background
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sample')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5)) / 1000
+
+MODES = ('cprofile', 'sample')
+PROFILE_EXTENSIONS = ('.pstats', '.speedscope.json')
+
+# Runtime toggle set through the admin endpoint, shared across workers via a file
+TOGGLE_FILE = os.path.join(PROFILE_DIR, 'toggle.json')
+_TOGGLE_CACHE_SECONDS = 2.0
+_DEFAULT_TOGGLE = {'until': 0.0, 'mode': PROFILE_MODE, 'path_prefix': '/api/'}
+_toggle_cache = {'read_at': 0.0, 'value': dict(_DEFAULT_TOGGLE)}
+_toggle_lock = threading.Lock()
+_ring_lock = threading.Lock()
+
+
+class CProfileCollector:
+    mode = 'cprofile'
+    extension = '.pstats'
+
+    def __init__(self):
+        self._profiler = cProfile.Profile()
+
+    def start(self):
+        # Raises ValueError if another profiler is already active in this thread
+        self._profiler.enable()
+
+    def stop(self):
+        self._profiler.disable()
+
+    def write(self, path, name):
+        self._profiler.dump_stats(path)
+
+
+class SamplingCollector:
+    """Samples the request thread's stack from a helper thread every ``interval`` seconds."""
+    mode = 'sample'
+    extension = '.speedscope.json'
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+        self._stacks = {}
+        self._started = 0.0
+        self._elapsed = 0.0
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._elapsed = time.perf_counter() - self._started
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            key = tuple(reversed(stack))
+            self._stacks[key] = self._stacks.get(key, 0.0) + (now - last)
+            last = now
+
+    def write(self, path, name):
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, weight in self._stacks.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(round(weight * 1000, 3))
+        doc = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'chatbot-backend',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': round(self._elapsed * 1000, 3),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(doc, f)
+
+
+COLLECTORS = {'cprofile': CProfileCollector, 'sample': SamplingCollector}
+
+
+def _read_toggle(max_age: float = _TOGGLE_CACHE_SECONDS) -> dict:
+    now = time.monotonic()
+    with _toggle_lock:
+        if now - _toggle_cache['read_at'] < max_age:
+            return _toggle_cache['value']
+    try:
+        with open(TOGGLE_FILE, encoding='utf-8') as f:
+            value = {**_DEFAULT_TOGGLE, **json.load(f)}
+    except (OSError, ValueError):
+        value = dict(_DEFAULT_TOGGLE)
+    with _toggle_lock:
+        _toggle_cache.update(read_at=now, value=value)
+    return value
+
+
+def set_toggle(enabled: bool, duration_seconds: float = 300, mode: str = PROFILE_MODE, path_prefix: str = '/api/'):
+    value = {
+        'until': time.time() + duration_seconds if enabled else 0.0,
+        'mode': mode,
+        'path_prefix': path_prefix,
+    }
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # Write-then-rename so other workers never read a partial file
+    tmp_path = f"{TOGGLE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, TOGGLE_FILE)
+    with _toggle_lock:
+        _toggle_cache.update(read_at=time.monotonic(), value=value)
+
+
+def get_status() -> dict:
+    toggle = _read_toggle(max_age=0)
+    until = toggle['until']
+    return {
+        'enabled': until > time.time(),
+        'enabled_until': datetime.utcfromtimestamp(until).isoformat() if until > time.time() else None,
+        'mode': toggle['mode'],
+        'path_prefix': toggle['path_prefix'],
+        'sample_rate': PROFILE_SAMPLE_RATE,
+        'profile_dir': PROFILE_DIR,
+        'max_files': PROFILE_MAX_FILES,
+    }
+
+
+def _choose_mode():
+    """Return the collector mode for the current request, or None to skip profiling."""
+    if request.path.startswith('/api/admin/') or not request.path.startswith('/api/'):
+        return None
+    header = (request.headers.get('X-Profile') or '').strip().lower()
+    if header and header not in ('0', 'false') and is_admin_request():
+        return header if header in MODES else PROFILE_MODE
+    toggle = _read_toggle()
+    if toggle['until'] > time.time() and request.path.startswith(toggle['path_prefix']):
+        return toggle['mode']
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return PROFILE_MODE
+    return None
+
+
+def _slug(value: str) -> str:
+    return re.sub(r'[^A-Za-z0-9]+', '_', value).strip('_')[:60] or 'root'
+
+
+def _trim_ring_buffer():
+    entries = list_profiles()
+    for entry in entries[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, entry['name']))
+        except OSError:
+            pass
+
+
+def list_profiles() -> list[dict]:
+    """Stored profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(PROFILE_EXTENSIONS):
+            continue
+        stat = os.stat(os.path.join(PROFILE_DIR, name))
+        entries.append((stat.st_mtime, {
+            'name': name,
+            'format': 'pstats' if name.endswith('.pstats') else 'speedscope',
+            'size': stat.st_size,
+            'created_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+        }))
+    entries.sort(key=lambda e: e[0], reverse=True)
+    return [entry for _, entry in entries]
+
+
+def _start_profile():
+    mode = _choose_mode()
+    if mode is None:
+        return
+    collector = COLLECTORS[mode]()
+    try:
+        collector.start()
+    except ValueError:
+        return  # another profiler is running in this thread
+    g._profile_collector = collector
+    g._profile_started = time.perf_counter()
+
+
+def _finish_profile(response=None):
+    collector = g.pop('_profile_collector', None)
+    if collector is None:
+        return response
+    collector.stop()
+    elapsed_ms = (time.perf_counter() - g.pop('_profile_started')) * 1000
+    rule = request.url_rule.rule if request.url_rule else request.path
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    name = f"{stamp}-{request.method}-{_slug(rule)}-{int(elapsed_ms)}ms-{uuid.uuid4().hex[:8]}{collector.extension}"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        collector.write(os.path.join(PROFILE_DIR, name), f"{request.method} {rule}")
+        with _ring_lock:
+            _trim_ring_buffer()
+    except OSError:
+        return response
+    if response is not None:
+        response.headers['X-Profile-Id'] = name
+    return response
+
+
+def init_app(app):
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    # Covers requests that raised before after_request ran
+    app.teardown_request(lambda exc: _finish_profile())
@@ -0,0 +1,109 @@
+# src/services/serialization.py
+"""Fast JSON responses and response compression.
+
+``FastJSONProvider`` replaces Flask's JSON provider with orjson when it is
+installed, so ``jsonify`` encodes in C and datetimes are serialized directly
+(as ISO 8601, the same format ``to_dict()`` produces). Without orjson it
+falls back to the stdlib encoder with the same output.
+
+``init_app`` also compresses JSON/text responses above
+``COMPRESS_MIN_BYTES`` with brotli (if installed) or gzip, based on the
+client's ``Accept-Encoding``.
+"""
+import gzip
+import os
+from datetime import date, datetime
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'image/svg+xml')
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('indent') or kwargs.get('cls'):
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _dumps_bytes(self, obj) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if orjson is None or pretty:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+
+def _is_compressible(mimetype: str) -> bool:
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or not _is_compressible(response.mimetype or '')):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
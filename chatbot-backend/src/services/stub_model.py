@@ -0,0 +1,29 @@
+# src/services/stub_model.py
+"""Offline stand-in for the Gemini model, used for load tests and local runs.
+
+Enable with ``CHAT_MODEL_PROVIDER=stub``. ``STUB_MODEL_LATENCY_MS`` adds a
+fixed delay per call to mimic model latency.
+"""
+import os
+import time
+from types import SimpleNamespace
+
+STUB_MODEL_LATENCY_MS = float(os.getenv('STUB_MODEL_LATENCY_MS', 0))
+
+
+class StubModel:
+    def __init__(self, latency_ms: float = STUB_MODEL_LATENCY_MS):
+        self.latency = latency_ms / 1000
+
+    def generate_content(self, contents):
+        if self.latency:
+            time.sleep(self.latency)
+        parts = contents if isinstance(contents, list) else [contents]
+        question = str(parts[-1])
+        return SimpleNamespace(
+            text=f"[stub] {question[:200]}",
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=sum(len(str(p)) for p in parts) // 4,
+                cached_content_token_count=0,
+            ),
+        )
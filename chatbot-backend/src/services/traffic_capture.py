@@ -0,0 +1,184 @@
+# src/services/traffic_capture.py
+"""Anonymized request trace capture for offline load replay.
+
+Enable by setting ``TRAFFIC_CAPTURE_PATH``. Each API request appends one
+compact JSON line to that file. Fields:
+
+  t     start time (epoch seconds)      m     HTTP method
+  r     route rule (no ids)             s     status code
+  d     duration in ms                  db    time spent in SQL, ms
+  qb    request body bytes              rb    response body bytes
+  sess  session alias                   new   request created the session
+  auth  caller sent a token             ml    chat message length
+  f     upload: kind, size, content alias
+  lock  SQLite reported "database is locked"
+
+Session ids and file hashes are replaced by keyed aliases: reuse patterns
+are kept, but the original values cannot be recovered. No message text or
+file content is written. ``scripts/replay_traffic.py`` replays the log.
+
+Aliases are keyed by ``TRAFFIC_CAPTURE_SALT`` (or ``FLASK_SECRET_KEY``).
+Capture stays off when neither is set, since the built-in dev secret is
+public and would let anyone holding a trace reverse the aliases.
+"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from src.models.user import db
+
+TRAFFIC_CAPTURE_PATH = os.getenv('TRAFFIC_CAPTURE_PATH')
+# main.py's fallback SECRET_KEY; never usable as an alias key
+_DEV_SECRET_KEY = 'dev-secret-key'
+
+_write_lock = threading.Lock()
+_log_file = None
+
+
+def _salt() -> bytes | None:
+    # Shared by all workers so they produce the same aliases
+    secret = os.getenv('TRAFFIC_CAPTURE_SALT') or os.getenv('FLASK_SECRET_KEY')
+    if not secret or secret == _DEV_SECRET_KEY:
+        return None
+    return hmac.new(secret.encode('utf-8'), b'traffic-capture', hashlib.sha256).digest()
+
+
+def _alias(salt: bytes, value) -> str | None:
+    if not value:
+        return None
+    return hmac.new(salt, str(value).encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+
+def _parsed_json():
+    # Only look at a body the view already parsed; re-reading may raise (e.g. 413)
+    data = request.get_json(silent=True, cache=True) if '_cached_json' in request.__dict__ else None
+    return data if isinstance(data, dict) else {}
+
+
+def _request_session_id():
+    if request.view_args and request.view_args.get('session_id'):
+        return request.view_args['session_id']
+    data = _parsed_json()
+    if data.get('session_id'):
+        return data['session_id']
+    # request.form is only in __dict__ once parsing succeeded; never re-parse here
+    if 'form' in request.__dict__ and request.form.get('session_id'):
+        return request.form['session_id']
+    return request.args.get('session_id')
+
+
+def _upload_info(salt: bytes, status_code: int):
+    kind = getattr(request, 'upload_kind', None)
+    spool = getattr(request, 'upload_spool', None)
+    if kind is None and spool is None:
+        return None
+    if spool is not None and status_code != 413:
+        size = spool.size
+    else:
+        # Parsing was cut short; the request length is the closest to the real size
+        size = request.content_length
+    return {
+        'k': kind,
+        'z': size,
+        'h': _alias(salt, spool.sha256) if spool is not None and status_code != 413 else None,
+    }
+
+
+def _response_json(response):
+    if response.is_json and not response.is_streamed:
+        data = response.get_json(silent=True)
+        return data if isinstance(data, dict) else {}
+    return {}
+
+
+def _write(record: dict):
+    global _log_file
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    with _write_lock:
+        if _log_file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(TRAFFIC_CAPTURE_PATH)), exist_ok=True)
+            _log_file = open(TRAFFIC_CAPTURE_PATH, 'a', encoding='utf-8', buffering=1)
+        _log_file.write(line)
+
+
+def _on_cursor_start(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and '_capture_start' in g:
+        g._capture_db_started = time.perf_counter()
+
+
+def _on_cursor_end(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and '_capture_db_started' in g:
+        g._capture_db_ms += (time.perf_counter() - g.pop('_capture_db_started')) * 1000
+
+
+def _on_db_error(context):
+    if has_request_context() and '_capture_start' in g:
+        g.pop('_capture_db_started', None)
+        if 'database is locked' in str(context.original_exception):
+            g._capture_lock = True
+
+
+def init_app(app):
+    if not TRAFFIC_CAPTURE_PATH:
+        return
+    salt = _salt()
+    if salt is None:
+        app.logger.warning('TRAFFIC_CAPTURE_PATH is set but traffic capture is disabled: '
+                           'set TRAFFIC_CAPTURE_SALT (or a non-default FLASK_SECRET_KEY)')
+        return
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _on_cursor_start)
+        event.listen(db.engine, 'after_cursor_execute', _on_cursor_end)
+        event.listen(db.engine, 'handle_error', _on_db_error)
+
+    @app.before_request
+    def _capture_start():
+        if request.path.startswith('/api/') and not request.path.startswith('/api/admin/'):
+            g._capture_start = time.time()
+            g._capture_perf = time.perf_counter()
+            g._capture_db_ms = 0.0
+            g._capture_lock = False
+
+    @app.after_request
+    def _capture_finish(response):
+        if '_capture_start' not in g:
+            return response
+        # The base record never touches the request body, so it is always written
+        record = {
+            't': round(g._capture_start, 4),
+            'm': request.method,
+            'r': request.url_rule.rule if request.url_rule else request.path,
+            's': response.status_code,
+            'd': round((time.perf_counter() - g._capture_perf) * 1000, 2),
+            'db': round(g._capture_db_ms, 2),
+            'qb': request.content_length or 0,
+            'rb': response.calculate_content_length() or 0,
+            'auth': bool(request.headers.get('Authorization')),
+        }
+        try:
+            body = _response_json(response)
+            request_sid = _request_session_id()
+            record['sess'] = _alias(salt, request_sid or body.get('session_id'))
+            record['new'] = bool(body.get('session_id')) and not request_sid
+            message = _parsed_json().get('message')
+            if isinstance(message, str):
+                record['ml'] = len(message)
+            upload = _upload_info(salt, response.status_code)
+            if upload:
+                record['f'] = upload
+            if g._capture_lock or 'database is locked' in str(body.get('error', '')):
+                record['lock'] = True
+        except Exception:
+            app.logger.warning('traffic capture: partial record for %s', request.path, exc_info=True)
+        try:
+            _write(record)
+        except OSError:
+            app.logger.exception('traffic capture failed')
+        return response
@@ -0,0 +1,153 @@
+# src/services/uploads.py
+"""Streaming upload handling.
+
+Multipart file parts are written straight into an ``UploadSpool`` (a
+``SpooledTemporaryFile`` that moves to disk past a memory threshold) while
+the body is received. The spool enforces the size limit for the declared
+file type, hashes the bytes and keeps the leading bytes for type sniffing,
+so extractors can read the spooled file directly without extra copies.
+"""
+import hashlib
+import os
+import tempfile
+import zipfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+MB = 1024 * 1024
+
+# Bytes kept in memory per file part before spilling to a temp file on disk
+UPLOAD_SPOOL_MAX_MEMORY = int(os.getenv('UPLOAD_SPOOL_MAX_MEMORY', 1 * MB))
+
+# Per-type size limits, checked while the bytes arrive
+UPLOAD_LIMITS = {
+    'pdf': int(os.getenv('UPLOAD_MAX_PDF_MB', 50)) * MB,
+    'csv': int(os.getenv('UPLOAD_MAX_CSV_MB', 20)) * MB,
+    'xlsx': int(os.getenv('UPLOAD_MAX_XLSX_MB', 25)) * MB,
+    'pptx': int(os.getenv('UPLOAD_MAX_PPTX_MB', 50)) * MB,
+}
+MAX_UPLOAD_BYTES = max(UPLOAD_LIMITS.values())
+
+# Allowance for multipart boundaries and the other form fields
+_FORM_OVERHEAD = 1 * MB
+MAX_CONTENT_LENGTH = MAX_UPLOAD_BYTES + _FORM_OVERHEAD
+
+EXTENSION_KINDS = {
+    '.pdf': 'pdf',
+    '.csv': 'csv',
+    '.xlsx': 'xlsx',
+    '.ppt': 'pptx',
+    '.pptx': 'pptx',
+}
+
+_SNIFF_BYTES = 2048
+_OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+_ZIP_MAGIC = b'PK\x03\x04'
+_UTF16_BOMS = (b'\xff\xfe', b'\xfe\xff')
+_COPY_CHUNK = 64 * 1024
+
+
+def kind_from_filename(filename) -> str | None:
+    _, ext = os.path.splitext((filename or '').lower())
+    return EXTENSION_KINDS.get(ext)
+
+
+class UploadSpool(tempfile.SpooledTemporaryFile):
+    """Spooled file that hashes, size-checks and sniffs bytes as they are written."""
+
+    def __init__(self, filename=None, max_size: int = UPLOAD_SPOOL_MAX_MEMORY):
+        super().__init__(max_size=max_size)
+        self.declared_kind = kind_from_filename(filename)
+        self.limit = UPLOAD_LIMITS.get(self.declared_kind, MAX_UPLOAD_BYTES)
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._head = b''
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RequestEntityTooLarge(
+                f"File exceeds the {self.limit // MB} MB limit for {self.declared_kind or 'this'} uploads"
+            )
+        self._hasher.update(data)
+        if len(self._head) < _SNIFF_BYTES:
+            self._head += bytes(data[:_SNIFF_BYTES - len(self._head)])
+        return super().write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    def sniff_kind(self) -> str | None:
+        """Detect the real file type from magic bytes ('pdf', 'xlsx', 'pptx', 'ppt', 'csv')."""
+        head = self._head
+        if b'%PDF-' in head[:1024]:
+            return 'pdf'
+        if head.startswith(_OLE2_MAGIC):
+            return 'ppt'  # legacy binary Office document
+        if head.startswith(_ZIP_MAGIC):
+            return self._sniff_ooxml()
+        # Empty files and UTF-16 text (which contains NULs) are still text
+        if not head or head.startswith(_UTF16_BOMS) or b'\x00' not in head:
+            return 'csv'
+        return None
+
+    def text_encoding(self) -> str:
+        """Encoding to decode text uploads with, based on a leading BOM."""
+        if self._head.startswith(_UTF16_BOMS):
+            return 'utf-16'
+        if self._head.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8-sig'
+        return 'utf-8'
+
+    def _sniff_ooxml(self) -> str | None:
+        try:
+            self.seek(0)
+            with zipfile.ZipFile(self) as zf:
+                names = zf.namelist()
+        except zipfile.BadZipFile:
+            return None
+        finally:
+            self.seek(0)
+        if any(n.startswith('xl/') for n in names):
+            return 'xlsx'
+        if any(n.startswith('ppt/') for n in names):
+            return 'pptx'
+        return None
+
+
+def ensure_spool(file_storage) -> UploadSpool:
+    """Return the upload's spool, copying into one if another stream factory was used."""
+    stream = file_storage.stream
+    if isinstance(stream, UploadSpool):
+        stream.seek(0)
+        return stream
+    spool = UploadSpool(file_storage.filename)
+    while True:
+        chunk = stream.read(_COPY_CHUNK)
+        if not chunk:
+            break
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+class UploadRequest(Request):
+    """Request class that streams multipart file parts into ``UploadSpool`` objects.
+
+    The last file part's declared kind and spool are kept on the request
+    (``upload_kind``, ``upload_spool``) so they can be inspected without
+    re-parsing the form, even when parsing was aborted with a 413.
+    """
+    upload_kind = None
+    upload_spool = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        self.upload_kind = kind_from_filename(filename)
+        limit = UPLOAD_LIMITS.get(self.upload_kind, MAX_UPLOAD_BYTES)
+        # Reject before reading the body when the declared length is already too big
+        if total_content_length is not None and total_content_length > limit + _FORM_OVERHEAD:
+            raise RequestEntityTooLarge(f"Upload exceeds the {limit // MB} MB limit for this file type")
+        self.upload_spool = UploadSpool(filename, max_size=UPLOAD_SPOOL_MAX_MEMORY)
+        return self.upload_spool